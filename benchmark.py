@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+# Table view benchmark
+#
+# Generates a requirements tree, opens it with a RequirementManager on the offscreen
+# platform and scripts the usual interactions (wheel scrolling, page jumps, text column
+# resizes, indentation toggle). Every interaction is followed by a synchronous repaint,
+# timed as a frame.
+#
+# Exits with an error if a budget is exceeded, e.g.:
+#   ./benchmark.py --items 5000 --budget-p95-frame-ms 50 --budget-memory-mb 600
+
+import os
+import sys
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen') # before any QApplication is created
+import argparse
+import json
+import logging
+import random
+import tempfile
+import time
+
+from PySide6.QtWidgets import *
+from PySide6.QtCore import *
+from PySide6.QtGui import *
+
+import doorhole
+
+try:
+	import resource # peak RSS, not available on Windows
+except ImportError:
+	resource = None
+
+# budget name -> description; command line options are --budget-<name with dashes>
+BUDGETS = {
+	'p95_frame_ms': '95th percentile frame time, worst interaction',
+	'max_frame_ms': 'slowest frame',
+	'first_screen_ms': 'time to the first painted screen',
+	'delegate_ms': 'total time in RequirementsDelegate.paint() and sizeHint()',
+	'memory_mb': 'peak resident memory',
+}
+
+WORDS = 'the system shall provide report data user value within seconds when configured interface error message level limit each operator'.split()
+
+def generateTree(path, documents, items, seed):
+	'''Writes a doorstop tree: documents chained as parent -> child, items linked to the parent document.'''
+	rnd = random.Random(seed) # same tree for the same seed
+	digits = max(3, len(str(items)))
+	prefixes = ['D' + chr(ord('A') + i) for i in range(documents)]
+	for d, prefix in enumerate(prefixes):
+		docPath = os.path.join(path, prefix)
+		os.makedirs(docPath)
+		settings = {'prefix': prefix, 'sep': '', 'digits': digits}
+		if d:
+			settings['parent'] = prefixes[d - 1]
+		with open(os.path.join(docPath, '.doorstop.yml'), 'w') as f:
+			json.dump({'settings': settings}, f) # JSON is valid YAML
+
+		chapter, section = 0, 0
+		for n in range(1, items + 1):
+			if section == 0 or rnd.random() < 0.05:
+				chapter, section = chapter + 1, 0
+			level = str(chapter) + '.' + str(section)
+			heading = section == 0
+			section += 1
+
+			sentences = []
+			for s in range(rnd.randint(1, 6)):
+				sentences.append(' '.join(rnd.choice(WORDS) for w in range(rnd.randint(5, 25))).capitalize() + '.')
+			text = ' '.join(sentences)
+			if not heading and rnd.random() < 0.2:
+				text += '\n\n' + '\n'.join('- ' + rnd.choice(WORDS) for i in range(rnd.randint(2, 6)))
+			if not heading and rnd.random() < 0.05:
+				text += '\n\n| Parameter | Value |\n| --- | --- |\n' + '\n'.join('| ' + rnd.choice(WORDS) + ' | ' + str(rnd.randint(0, 999)) + ' |' for i in range(4))
+
+			links = []
+			if d and not heading:
+				links = [{prefixes[d - 1] + str(rnd.randint(1, items)).zfill(digits): None}]
+			item = {
+				'active': True,
+				'derived': rnd.random() < 0.1,
+				'header': '' if rnd.random() < 0.5 else ' '.join(rnd.choice(WORDS) for w in range(3)),
+				'level': level,
+				'links': links,
+				'normative': not heading and rnd.random() < 0.9,
+				'ref': '',
+				'reviewed': None,
+				'status': rnd.choice(['draft', 'approved', 'obsolete']), # custom attribute
+				'text': text,
+			}
+			with open(os.path.join(docPath, prefix + str(n).zfill(digits) + '.yml'), 'w') as f:
+				json.dump(item, f)
+	return prefixes
+
+class TimedDelegate(doorhole.RequirementsDelegate):
+	'''Accumulates the time spent in paint() and sizeHint().'''
+	def __init__(self, parent=None):
+		super(TimedDelegate, self).__init__(parent)
+		self.times = {'paint': [0.0, 0], 'sizeHint': [0.0, 0]}
+
+	def paint(self, painter, option, index):
+		begin = time.perf_counter()
+		super(TimedDelegate, self).paint(painter, option, index)
+		self._add('paint', begin)
+
+	def sizeHint(self, option, index):
+		begin = time.perf_counter()
+		size = super(TimedDelegate, self).sizeHint(option, index)
+		self._add('sizeHint', begin)
+		return size
+
+	def _add(self, name, begin):
+		self.times[name][0] += time.perf_counter() - begin
+		self.times[name][1] += 1
+
+class BenchmarkManager(doorhole.RequirementManager):
+	def loadDelegate(self):
+		self.delegate = TimedDelegate()
+
+class Benchmark():
+	'''Scripted interactions on a RequirementManager, each one timed as a frame.'''
+	def __init__(self, docId, width, height):
+		self.frames = {} # phase -> frame times, in seconds
+		self.width, self.height = width, height
+		begin = time.perf_counter()
+		self.manager = BenchmarkManager(docId)
+		self.manager.resize(width, height)
+		self.manager.show()
+		QApplication.processEvents()
+		self.view = self.manager.view
+		self.view.viewport().repaint()
+		self.frames['first screen'] = [time.perf_counter() - begin]
+
+	def frame(self, phase, action):
+		begin = time.perf_counter()
+		action()
+		QApplication.processEvents()
+		self.view.viewport().repaint()
+		self.frames.setdefault(phase, []).append(time.perf_counter() - begin)
+
+	def wheel(self, steps):
+		viewport = self.view.viewport()
+		pos = QPointF(viewport.width() / 2, viewport.height() / 2)
+		def scroll():
+			event = QWheelEvent(pos, QPointF(viewport.mapToGlobal(pos.toPoint())), QPoint(0, 0), QPoint(0, -120), Qt.NoButton, Qt.NoModifier, Qt.NoScrollPhase, False)
+			QApplication.sendEvent(viewport, event)
+		for i in range(steps):
+			self.frame('wheel scroll', scroll)
+
+	def pageJumps(self, steps):
+		scrollBar = self.view.verticalScrollBar()
+		self.frame('page jump', lambda: scrollBar.triggerAction(QAbstractSlider.SliderToMinimum))
+		for i in range(steps):
+			self.frame('page jump', lambda: scrollBar.triggerAction(QAbstractSlider.SliderPageStepAdd))
+		self.frame('page jump', lambda: scrollBar.triggerAction(QAbstractSlider.SliderToMaximum))
+		self.frame('page jump', lambda: scrollBar.triggerAction(QAbstractSlider.SliderToMinimum))
+
+	def resizes(self, steps):
+		# the text column is stretched: resizing the manager resizes the text column
+		for i in range(steps):
+			width = self.width - (i % 4) * self.width // 8
+			self.frame('text column resize', lambda: self.manager.resize(width, self.height))
+		self.frame('text column resize', lambda: self.manager.resize(self.width, self.height))
+
+	def indentToggles(self, steps):
+		for i in range(steps):
+			self.frame('indent toggle', lambda: self.manager.indentToggle.setChecked(not self.manager.indentToggle.isChecked()))
+
+def summary(times):
+	times = sorted(times)
+	return {
+		'frames': len(times),
+		'mean_ms': 1000 * sum(times) / len(times),
+		'p50_ms': 1000 * times[len(times) // 2],
+		'p95_ms': 1000 * times[min(len(times) - 1, int(len(times) * 0.95))],
+		'max_ms': 1000 * times[-1],
+	}
+
+def peakMemoryMB():
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, kilobytes elsewhere
+
+def checkBudgets(results, budgets):
+	'''Returns the exceeded budgets, as messages.'''
+	phases = [s for phase, s in results['phases'].items() if phase != 'first screen'] # it has its own budget
+	checks = {
+		'p95_frame_ms': max(s['p95_ms'] for s in phases),
+		'max_frame_ms': max(s['max_ms'] for s in phases),
+		'first_screen_ms': results['phases']['first screen']['max_ms'],
+		'delegate_ms': results['delegate']['paint']['total_ms'] + results['delegate']['sizeHint']['total_ms'],
+		'memory_mb': results['peak_memory_mb'],
+	}
+	exceeded = []
+	for name, limit in budgets.items():
+		if checks[name] is not None and checks[name] > limit:
+			exceeded.append('{}: {:.1f} > {:.1f}'.format(name, checks[name], limit))
+	return exceeded
+
+def parseArgs(argv):
+	parser = argparse.ArgumentParser(description='Scroll/resize frame-time benchmark of the doorhole table view.')
+	parser.add_argument('--documents', type=int, default=2, help='generated documents (default: %(default)s)')
+	parser.add_argument('--items', type=int, default=2000, help='generated items per document (default: %(default)s)')
+	parser.add_argument('--seed', type=int, default=1, help='random seed of the generated tree (default: %(default)s)')
+	parser.add_argument('--steps', type=int, default=40, help='frames for each interaction (default: %(default)s)')
+	parser.add_argument('--size', default='1400x900', help='window size (default: %(default)s)')
+	parser.add_argument('--output', help='write the results to this JSON file')
+	parser.add_argument('--budgets', help='JSON file with budgets, e.g. {"p95_frame_ms": 50}')
+	for name, description in BUDGETS.items():
+		parser.add_argument('--budget-' + name.replace('_', '-'), type=float, help='fail above this ' + description)
+	args = parser.parse_args(argv[1:])
+
+	try:
+		args.width, args.height = (int(n) for n in args.size.lower().split('x'))
+	except ValueError:
+		parser.error('invalid window size: ' + args.size + ' (expected WIDTHxHEIGHT, e.g. 1400x900)')
+	if args.width <= 0 or args.height <= 0:
+		parser.error('invalid window size: ' + args.size + ' (width and height must be positive)')
+
+	# budgets are checked now, not after a long run
+	budgets = {}
+	if args.budgets:
+		try:
+			with open(args.budgets) as f:
+				budgets = json.load(f)
+		except (OSError, ValueError) as e:
+			parser.error('cannot read budgets: ' + str(e))
+		if not isinstance(budgets, dict):
+			parser.error('budgets must be a JSON object, e.g. {"p95_frame_ms": 50}')
+	for name in budgets:
+		if name not in BUDGETS:
+			parser.error('unknown budget in ' + args.budgets + ': ' + name + ' (known: ' + ', '.join(BUDGETS) + ')')
+	for name in BUDGETS: # command line wins
+		if getattr(args, 'budget_' + name) is not None:
+			budgets[name] = getattr(args, 'budget_' + name)
+	args.budgets = {name: limit for name, limit in budgets.items() if limit is not None}
+	return args
+
+def main(argv):
+	args = parseArgs(argv)
+	logging.getLogger(doorhole.__name__).setLevel(logging.WARNING)
+	width, height = args.width, args.height
+
+	app = QApplication(argv[:1]) # must outlive the widgets
+	with tempfile.TemporaryDirectory() as path:
+		treePath = os.path.join(path, 'tree')
+		prefixes = generateTree(treePath, args.documents, args.items, args.seed)
+		doorhole.loadDoorstop()
+		doorhole.reqtree = doorhole.doorstop.build(cwd=treePath, root=treePath)
+		doorhole.rendercache = doorhole.RenderCache(os.path.join(path, 'cache')) # cold cache, every run
+
+		benchmark = Benchmark(prefixes[-1], width, height) # the last document has links
+		benchmark.wheel(args.steps)
+		benchmark.pageJumps(args.steps // 4)
+		benchmark.resizes(args.steps // 4)
+		benchmark.indentToggles(4)
+
+		delegateTimes = benchmark.manager.delegate.times
+		results = {
+			'documents': args.documents,
+			'items': args.items,
+			'seed': args.seed,
+			'phases': {phase: summary(times) for phase, times in benchmark.frames.items()},
+			'delegate': {name: {'total_ms': 1000 * total, 'calls': calls} for name, (total, calls) in delegateTimes.items()},
+			'peak_memory_mb': peakMemoryMB(),
+		}
+		benchmark.manager.close()
+
+	for phase, s in results['phases'].items():
+		print('{:20} {:4} frames  mean {:8.1f} ms  p50 {:8.1f} ms  p95 {:8.1f} ms  max {:8.1f} ms'.format(
+			phase, s['frames'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['max_ms']))
+	for name, d in results['delegate'].items():
+		print('{:20} {:8} calls  total {:8.1f} ms'.format('delegate ' + name, d['calls'], d['total_ms']))
+	if results['peak_memory_mb'] is not None:
+		print('{:20} {:8.1f} MB'.format('peak memory', results['peak_memory_mb']))
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2)
+
+	exceeded = checkBudgets(results, args.budgets)
+	for message in exceeded:
+		print('Budget exceeded - ' + message)
+	return 1 if exceeded else 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
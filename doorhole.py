@@ -3,32 +3,49 @@
 # Checks functional requirements with regexes
 # Builds functional matrix
 
-import doorstop
-from doorstop.core.types import iter_documents, iter_items, Level
 import os
 import sys
+import time
+startupBegin = time.perf_counter() # reference for --startup-profile
 from PySide6.QtWidgets import *
 from PySide6.QtCore import *
 from PySide6.QtGui import *
-from PySide6.QtWebEngineWidgets import *
+startupQt = time.perf_counter()
 import logging
-import markdown
-from plantuml_markdown import PlantUMLMarkdownExtension
 import tempfile
 import copy
-
-EXTENSIONS = (
+import hashlib
+import json
+import argparse
+import contextlib
+import math
+from collections import Counter
+import threading
+
+# PlantUML web renderer
+PLANTUML_SERVER = 'http://www.plantuml.com/plantuml'
+
+# Markdown rendering settings (also part of the render cache keys)
+MARKDOWN_EXTENSIONS = (
 	'markdown.extensions.extra',
 	'markdown.extensions.sane_lists',
-	PlantUMLMarkdownExtension(
-		server='http://www.plantuml.com/plantuml',
-		cachedir=tempfile.gettempdir(),
-		format='svg',
-		classes='class1,class2',
-		title='UML',
-		alt='UML Diagram',
-	),
 )
+PLANTUML_OPTIONS = dict(
+	server=PLANTUML_SERVER,
+	format='svg',
+	classes='class1,class2',
+	title='UML',
+	alt='UML Diagram',
+)
+
+# Heavy modules are imported on first use, so that the window shows up as soon as possible.
+# See loadDoorstop() and loadMarkdown().
+doorstop = None
+iter_documents = None
+iter_items = None
+Level = None
+markdown = None
+PlantUMLMarkdownExtension = None
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 logging.getLogger('doorstop').setLevel(logging.WARNING)
@@ -37,10 +54,298 @@ logger = logging.getLogger
 log = logger(__name__)
 
 
+class StartupProfile():
+	'''
+	Timings of the startup phases.
+	Always collected (it's cheap), reported with --startup-profile.
+	'''
+	def __init__(self):
+		self.steps = [('import PySide6', startupBegin, startupQt)]
+
+	@contextlib.contextmanager
+	def step(self, name):
+		begin = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.steps.append((name, begin, time.perf_counter()))
+
+	def mark(self, name): # zero-length step, e.g. "window visible"
+		now = time.perf_counter()
+		self.steps.append((name, now, now))
+
+	def report(self):
+		log.info('Startup profile (seconds since script start / duration):')
+		for name, begin, end in self.steps:
+			log.info('  {:8.3f}  {:8.3f}  {}'.format(end - startupBegin, end - begin, name))
+
+profile = StartupProfile()
+
+def loadDoorstop():
+	global doorstop, iter_documents, iter_items, Level
+	if doorstop is None:
+		with profile.step('import doorstop'):
+			import doorstop
+			from doorstop.core.types import iter_documents, iter_items, Level
+
+def loadMarkdown():
+	global markdown, PlantUMLMarkdownExtension
+	if markdown is None:
+		with profile.step('import markdown'):
+			import markdown
+			from plantuml_markdown import PlantUMLMarkdownExtension
+
+def markdownExtensions(basedir):
+	'''Extensions for texts stored in basedir: PlantUML includes are relative to it.'''
+	loadMarkdown()
+	return MARKDOWN_EXTENSIONS + (
+		PlantUMLMarkdownExtension(cachedir=tempfile.gettempdir(), base_dir=basedir, **PLANTUML_OPTIONS),
+	)
+
 # requirements tree is a global because it's shared by all classes.
 # Maybe it should become a singleton.
 reqtree = None
 
+# rendered text cache is shared by all delegates, like the requirements tree.
+rendercache = None
+
+def viewSettings():
+	'''Persistent storage for the view state (column widths, scroll position, ...).'''
+	return QSettings('doorhole', 'doorhole')
+
+def settingsKey(path):
+	'''Short, filesystem- and registry-safe key identifying a document or tree on disk.'''
+	return hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()[:16]
+
+def renderCache():
+	'''The render cache shared by all delegates, created on first use.'''
+	global rendercache
+	if rendercache is None:
+		rendercache = RenderCache()
+	return rendercache
+
+def requirementSource(item):
+	'''Markdown source of a requirement (mimicking doorstop), and the directory it must be rendered from.'''
+	text = item.get('text')
+	level = str(item.get('level'))
+	header = str(item.get('header'))
+	item_path = item.get('path') # doorstop property 'root' from DS item
+	item_path = os.path.dirname(os.path.realpath(item_path))
+
+	# mimick DS title and header attributes
+	lines = [l for l in text.splitlines()]
+	heading = ''
+	if level.endswith('.0'): # Chapter title
+		heading += '#'*level.count('.') + ' ' + level[:-2] + ' '
+		if header.strip(): # use header as heading
+			heading += header.strip() + '\n\n'
+			if (len(lines)): # append text, if any
+				lines = [heading] + lines
+			else:
+				lines = [heading]
+		else: # use first line as heading
+			if len(lines): # ...if any!
+				heading += lines[0] + '\n\n'
+				lines = [heading] + lines[1:]
+			else:
+				lines = [heading]
+	else: # Requirement
+		if header.strip(): # use header as heading
+			heading += '#'*(level.count('.') +1) + ' ' + level + ' ' + header.strip()
+			if item.normative:
+				heading += ' (' + str(item.uid) + ')'
+		else: # use UID as heading
+			heading += '#'*(level.count('.') +1) + ' ' + level + ' ' + str(item.uid)
+		lines = [heading] + lines
+	return '\n'.join(lines), item_path
+
+class RenderCache():
+	'''
+	Disk-backed cache of rendered requirement text.
+
+	Stores:
+		- the HTML produced by markdown (and PlantUML), one file per requirement text
+		- the measured size of the text cell, for each column width
+
+	Everything is keyed by the hash of the markdown source (and of the directory it is
+	rendered from, because of relative links) and of the renderer settings and versions,
+	so edited requirements get a new entry and stale ones are never used.
+	Linked files (e.g. images) are not part of the key.
+
+	HTML files not used for MAX_HTML_AGE are deleted by save().
+
+	Sizes are stored in one file for each document and column width, read when first used.
+	Only the last used widths of a document are kept in memory (not the intermediate widths
+	of a window resize), and size files not used for MAX_SIZES_AGE are deleted by save().
+
+	Rendering is thread safe and does not change the working directory: the cache is shared
+	with the --serve mode. Relative links are resolved with a markdown converter for each
+	directory (PlantUML includes) and with the document base URL (images, see RequirementsDelegate).
+	'''
+	RENDER_VERSION = 1 # bump when the rendering changes in a way the settings and versions don't tell
+	MAX_HTML_AGE = 30 * 24 * 3600 # seconds
+	MAX_HTML_MEMORY = 2000 # rendered texts kept in memory, least recently used are dropped
+	MAX_WIDTHS = 3 # column widths of a document whose sizes are kept in memory, least recently used are dropped
+	MAX_SIZES_AGE = 30 * 24 * 3600 # seconds
+
+	def __init__(self, path=None):
+		if path is None:
+			path = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), 'doorhole')
+		self.path = path
+		self._html = {} # key -> HTML, least recently used first
+		self._htmlLock = threading.Lock()
+		self._renderer = None
+		self._sizes = {} # (document, column width) -> {key: size}, least recently used first
+		self._used = {} # (document, column width) -> sizes used in this session
+		self._lastSizes = None
+		self._font = None
+		self._md = {} # directory -> markdown converter, created on the first conversion: the markdown stack may not be needed at all
+		self._lock = threading.Lock()
+		try:
+			os.makedirs(self.path, exist_ok=True)
+		except OSError as e:
+			log.warning('Cannot create render cache: ' + str(e))
+
+	def _sizesPath(self, document, width):
+		if self._font is None: # sizes depend on the font too
+			self._font = hashlib.sha1(QApplication.font().key().encode('utf-8')).hexdigest()[:8]
+		return os.path.join(self.path, 'sizes-' + self._font + '-' + document + '-' + str(width) + '.json')
+
+	def _htmlPath(self, key):
+		return os.path.join(self.path, key + '.html')
+
+	def _rendererKey(self):
+		if self._renderer is None:
+			import importlib.metadata # not needed for startup
+			versions = []
+			for package in ('markdown', 'plantuml-markdown'):
+				try:
+					versions.append(importlib.metadata.version(package))
+				except importlib.metadata.PackageNotFoundError:
+					versions.append(None)
+			renderer = [self.RENDER_VERSION, MARKDOWN_EXTENSIONS, PLANTUML_OPTIONS, versions]
+			self._renderer = json.dumps(renderer, sort_keys=True).encode('utf-8')
+		return self._renderer
+
+	def key(self, text, basedir):
+		h = hashlib.sha1(self._rendererKey())
+		h.update(b'\0')
+		h.update(basedir.encode('utf-8'))
+		h.update(b'\0')
+		h.update(text.encode('utf-8'))
+		return h.hexdigest()
+
+	def _remember(self, key, html):
+		with self._htmlLock:
+			self._html.pop(key, None)
+			self._html[key] = html # last used
+			while len(self._html) > self.MAX_HTML_MEMORY:
+				del self._html[next(iter(self._html))]
+
+	def html(self, key):
+		with self._htmlLock:
+			html = self._html.get(key)
+		if html is None:
+			try:
+				with open(self._htmlPath(key), encoding='utf-8') as f:
+					html = f.read()
+				os.utime(self._htmlPath(key)) # used: not to be deleted by save()
+			except OSError:
+				return None
+		self._remember(key, html)
+		return html
+
+	def setHtml(self, key, html):
+		self._remember(key, html)
+		try:
+			tmp = self._htmlPath(key) + '.' + str(threading.get_ident()) # concurrent writers of the same key
+			with open(tmp, 'w', encoding='utf-8') as f:
+				f.write(html)
+			os.replace(tmp, self._htmlPath(key))
+		except OSError as e:
+			log.warning('Cannot write render cache: ' + str(e))
+
+	def render(self, text, basedir):
+		'''HTML of a markdown text rendered from basedir, from the cache if possible. Raises on conversion errors.'''
+		key = self.key(text, basedir)
+		html = self.html(key)
+		if html is None:
+			with self._lock: # markdown converters are stateful
+				md = self._md.get(basedir)
+				if md is None:
+					extensions = markdownExtensions(basedir) # imports markdown
+					md = self._md[basedir] = markdown.Markdown(extensions=extensions)
+				html = md.reset().convert(text)
+			self.setHtml(key, html)
+		return html
+
+	def _documentSizes(self, document, width):
+		'''Sizes measured for a document at a column width. Dicts keep insertion order: the last used are at the end.'''
+		k = (document, width)
+		if k == self._lastSizes:
+			return self._sizes[k]
+		sizes = self._sizes.pop(k, None)
+		if sizes is None:
+			try:
+				with open(self._sizesPath(document, width), encoding='utf-8') as f:
+					sizes = json.load(f)
+			except (OSError, ValueError): # new width or broken cache: start from scratch
+				sizes = {}
+			self._used[k] = 0
+		self._sizes[k] = sizes
+		self._lastSizes = k
+		widths = [w for w in self._sizes if w[0] == document]
+		for w in widths[:-self.MAX_WIDTHS]: # e.g. the intermediate widths of a window resize
+			del self._sizes[w]
+			del self._used[w]
+		return sizes
+
+	def size(self, document, width, key, textWidth):
+		'''Size of a text rendered at textWidth, in a column width wide (they differ with indentation).'''
+		sizes = self._documentSizes(document, width)
+		k = key[:16] + ':' + str(textWidth)
+		size = sizes.pop(k, None)
+		if size is not None:
+			sizes[k] = size # last used
+			self._used[(document, width)] += 1
+		return size
+
+	def setSize(self, document, width, key, textWidth, size):
+		sizes = self._documentSizes(document, width)
+		sizes[key[:16] + ':' + str(textWidth)] = size
+		self._used[(document, width)] += 1
+
+	def save(self):
+		for (document, width), sizes in self._sizes.items():
+			used = self._used[(document, width)]
+			if not used:
+				continue
+			# sizes of edited or deleted requirements end up first (least recently used): drop them
+			for k in list(sizes)[:max(0, len(sizes) - 2 * used)]:
+				del sizes[k]
+			try:
+				path = self._sizesPath(document, width)
+				with open(path + '.tmp', 'w', encoding='utf-8') as f:
+					json.dump(sizes, f)
+				os.replace(path + '.tmp', path)
+			except OSError as e:
+				log.warning('Cannot write render cache: ' + str(e))
+
+		# keep the recently used files only
+		try:
+			now = time.time()
+			for e in os.scandir(self.path):
+				if e.name.endswith('.html'):
+					maxAge = self.MAX_HTML_AGE
+				elif e.name.startswith('sizes-') and e.name.endswith('.json'):
+					maxAge = self.MAX_SIZES_AGE
+				else:
+					continue
+				if e.stat().st_mtime < now - maxAge:
+					os.remove(e.path)
+		except OSError as e:
+			log.warning('Cannot clean render cache: ' + str(e))
+
 class RequirementsDelegate(QStyledItemDelegate):
 	# Constants
 	MIN_TEXT_WIDTH = 200  # Minimum width for the text column
@@ -52,10 +357,11 @@ class RequirementsDelegate(QStyledItemDelegate):
 	def __init__(self, parent=None):
 		super(RequirementsDelegate, self).__init__(parent)
 		self.doc = QTextDocument(self)
-		self.docIndex = None
+		self.docKey = None
 		self.h = None
 		self.w = None
-		self.md = markdown.Markdown(extensions=EXTENSIONS)
+
+		self.cache = renderCache()
 
 	def createEditor(self, parent, option, index):
 		colName = index.model()._headerData[index.column()]
@@ -128,64 +434,54 @@ class RequirementsDelegate(QStyledItemDelegate):
 		elif 'QPlainTextEdit' in editorType:
 			model.setData(index, editor.toPlainText())
 
-	def getDoc(self, option, index): # builds the doc inside self.doc, uses self.index as cache
-		if self.docIndex == index: # Doc already done
+	def getDoc(self, option, index): # builds the doc inside self.doc, uses self.docKey as cache
+		mdl = index.model()
+		if mdl._headerData[index.column()] != 'text':
+			return
+		text, item_path, key = mdl.rowSource(index.row())
+		if self.docKey == key: # Doc already done
 			return
 
 		# a new doc is to be rendered
-		self.docIndex = index
-		mdl = index.model()
-		if mdl._headerData[index.column()] == 'text':
-			item = mdl._data[index.row()][len(mdl._headerData)] # DS item cached in last column
-			text = item.get('text')
-			level = str(item.get('level'))
-			header = str(item.get('header'))
-			item_path = item.get('path') # doorstop property 'root' from DS item
-			item_path = os.path.dirname(os.path.realpath(item_path))
-
-			# mimick DS title and header attributes
-			lines = [l for l in text.splitlines()]
-			heading = ''
-			if level.endswith('.0'): # Chapter title
-				heading += '#'*level.count('.') + ' ' + level[:-2] + ' '
-				if header.strip(): # use header as heading
-					heading += header.strip() + '\n\n'
-					if (len(lines)): # append text, if any
-						lines = [heading] + lines
-					else:
-						lines = [heading]
-				else: # use first line as heading
-					if len(lines): # ...if any!
-						heading += lines[0] + '\n\n'
-						lines = [heading] + lines[1:]
-					else:
-						lines = [heading]
-			else: # Requirement
-				if header.strip(): # use header as heading
-					heading += '#'*(level.count('.') +1) + ' ' + level + ' ' + header.strip()
-					if item.normative:
-						heading += ' (' + str(item.uid) + ')'
-				else: # use UID as heading
-					heading += '#'*(level.count('.') +1) + ' ' + level + ' ' + str(item.uid)
-				lines = [heading] + lines
-			text = '\n'.join(lines)
-
-			# change work dir to where the reqs are stored, otherwise images will not be rendered
-			cwd_bkp = os.getcwd()
+		self.docKey = key
+		self.doc.setBaseUrl(QUrl.fromLocalFile(item_path + os.sep)) # linked items with relative paths (e.g. images)
+		try:
+			self.doc.setHtml(self.cache.render(text, item_path))
+		except Exception as e:
+			warning = '**An error occurred while displaying the content**\n\n: '+ str(e) + '\n\n'
+			text = warning + text
+			self.doc.setMarkdown(text)
+			self.docKey = None # errors are not cached, try again next time
+
+		# Document should be restricted to column width
+		options = QStyleOptionViewItem(option)
+		self.doc.setTextWidth(options.rect.width())
+
+	def textGeometry(self, width, item): # indentation and width available to the text, in a column width wide
+		indent = 0
+		available_width = width
+		if self.indentTextByLevel:
+			level_str = str(item.get('level'))
 			try:
-				os.path.dirname(os.path.realpath(__file__))
-				os.chdir(item_path) # necessary to solve linked items with relative paths (e.g. images)
-				html = self.md.convert(text)
-				self.doc.setHtml(html)
-			except Exception as e:
-				warning = '**An error occurred while displaying the content**\n\n: '+ str(e) + '\n\n'
-				text = warning + text
-				self.doc.setMarkdown(text)
-			os.chdir(cwd_bkp)
-
-			# Document should be restricted to column width
-			options = QStyleOptionViewItem(option)
-			self.doc.setTextWidth(options.rect.width())
+				level_depth = level_str.count('.')
+				# handle the x.0 edge case
+				if level_str.endswith(".0"):
+					level_depth = level_depth - 1
+			except Exception:
+				level_depth = 0
+			indent = self.INDENT_PER_LEVEL * level_depth
+			available_width = width - indent
+			if available_width < self.MIN_TEXT_WIDTH:
+				indent = max(0, width - self.MIN_TEXT_WIDTH)
+				available_width = self.MIN_TEXT_WIDTH
+		return indent, available_width
+
+	def cachedSize(self, mdl, row, width):
+		'''Size of the text cell of a row, in a column width wide, if it was measured before. Renders nothing.'''
+		item = mdl._data[row][len(mdl._headerData)]
+		indent, available_width = self.textGeometry(width, item)
+		size = self.cache.size(mdl._cacheId, width, mdl.rowSource(row)[2], available_width)
+		return [size[0] + indent, size[1]] if size is not None else None
 
 	def paint(self, painter, option, index):
 		mdl = index.model()
@@ -193,23 +489,8 @@ class RequirementsDelegate(QStyledItemDelegate):
 			# get rich text document and paint it
 			self.getDoc(option, index)
 			# Calculate indentation based on level
-			indent = 0
-			available_width = option.rect.width()
-			if self.indentTextByLevel:
-				item = mdl._data[index.row()][len(mdl._headerData)]
-				level_str = str(item.get('level'))
-				try:
-					level_depth = level_str.count('.')
-					# handle the x.0 edge case
-					if level_str.endswith(".0"):
-						level_depth = level_depth - 1
-				except Exception:
-					level_depth = 0
-				indent = self.INDENT_PER_LEVEL * level_depth
-				available_width = option.rect.width() - indent
-				if available_width < self.MIN_TEXT_WIDTH:
-					indent = max(0, option.rect.width() - self.MIN_TEXT_WIDTH)
-					available_width = self.MIN_TEXT_WIDTH
+			item = mdl._data[index.row()][len(mdl._headerData)]
+			indent, available_width = self.textGeometry(option.rect.width(), item)
 			ctx = QAbstractTextDocumentLayout.PaintContext()
 			painter.save()
 			painter.translate(option.rect.topLeft() + QPoint(indent, 0))
@@ -223,31 +504,25 @@ class RequirementsDelegate(QStyledItemDelegate):
 	def sizeHint(self, option, index):
 		mdl = index.model()
 		if mdl._headerData[index.column()] == 'text':
-			self.getDoc(option, index)
-			indent = 0
-			available_width = option.rect.width()
-			if self.indentTextByLevel:
+			# measured sizes are cached: no markdown conversion nor layout for known texts
+			size = self.cachedSize(mdl, index.row(), option.rect.width())
+			if size is None:
+				self.getDoc(option, index)
 				item = mdl._data[index.row()][len(mdl._headerData)]
-				level_str = str(item.get('level'))
-				try:
-					level_depth = level_str.count('.')
-					# handle the x.0 edge case
-					if level_str.endswith(".0"):
-						level_depth = level_depth - 1
-				except Exception:
-					level_depth = 0
-				indent = self.INDENT_PER_LEVEL * level_depth
-				available_width = option.rect.width() - indent
-				if available_width < self.MIN_TEXT_WIDTH:
-					indent = max(0, option.rect.width() - self.MIN_TEXT_WIDTH)
-					available_width = self.MIN_TEXT_WIDTH
-			self.doc.setTextWidth(available_width)
-			return QSize(self.doc.idealWidth() + indent, self.doc.size().height())
+				indent, available_width = self.textGeometry(option.rect.width(), item)
+				self.doc.setTextWidth(available_width)
+				size = [self.doc.idealWidth() + indent, self.doc.size().height()]
+				key = mdl.rowSource(index.row())[2]
+				if self.docKey == key: # do not remember the size of error messages
+					self.cache.setSize(mdl._cacheId, option.rect.width(), key, available_width, [size[0] - indent, size[1]])
+			return QSize(size[0], size[1])
 		else:
 			return QSize(0,0)
 			#super(RequirementsDelegate, self).sizeHint(option, index)
 
 class RequirementSetModel(QAbstractTableModel):
+	reloaded = Signal() # all rows replaced by load()
+
 	def __init__(self, docId=None, parent=None):
 		super(RequirementSetModel, self).__init__(parent)
 		self._docId = docId
@@ -257,6 +532,7 @@ class RequirementSetModel(QAbstractTableModel):
 	def load(self):
 		global reqtree
 		self._document = reqtree.find_document(self._docId)
+		self._cacheId = settingsKey(self._document.path) # render cache sizes of this document
 
 		# Requirements attributes
 		# -----------------------
@@ -288,7 +564,8 @@ class RequirementSetModel(QAbstractTableModel):
 		# And we have now the column names.
 		# We put 'text' always to the last column because it usually is stretched.
 		# The 'active' field is always true - inactive requirements are not shown at all. Doorstop doesn't tell us about them.
-		self._headerData = ['uid', 'path', 'root', 'normative', 'derived', 'reviewed', 'level', 'header', 'ref', 'references', 'links'] + list(userHeaderData) + ['text']
+		# Custom attributes are sorted, so that columns are the same from one session to the next.
+		self._headerData = ['uid', 'path', 'root', 'normative', 'derived', 'reviewed', 'level', 'header', 'ref', 'references', 'links'] + sorted(userHeaderData) + ['text']
 
 		# Another loop to fill in the table rows
 		self._data = []
@@ -298,7 +575,19 @@ class RequirementSetModel(QAbstractTableModel):
 				row.append(str(item.get(f)))
 			row.append(item) # Doorstop item reference cached in the last row
 			self._data.append(row)
+		self._userHeaderData = sorted(userHeaderData)
+		self._sources = [None] * len(self._data) # see rowSource()
 		log.debug('['+str(self._document)+'] Requirements reloaded')
+		self.reloaded.emit()
+
+	def rowSource(self, row):
+		'''Markdown source, rendering directory and render cache key of a row, computed once (until the row changes).'''
+		source = self._sources[row]
+		if source is None:
+			item = self._data[row][len(self._headerData)]
+			text, basedir = requirementSource(item)
+			source = self._sources[row] = (text, basedir, renderCache().key(text, basedir))
+		return source
 
 	# TableView methods that must be implemented
 	def rowCount(self, index):
@@ -401,6 +690,7 @@ class RequirementSetModel(QAbstractTableModel):
 				item.set_attributes(attributes)
 				item.save()
 				self._data[index.row()][index.column()] = item.get(attr)
+				self._sources[index.row()] = None # text, header, level... may have changed
 				log.debug('Updated requirement [' + str(item.get('uid')) + '] attribute ['+attr+']')
 				self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
 			except doorstop.DoorstopError as e:
@@ -461,6 +751,7 @@ class RequirementSetModel(QAbstractTableModel):
 	def _saveRowAndNotify(self, row):
 		"""Emit dataChanged for a row so the view updates (e.g. row header color)."""
 		if 0 <= row < len(self._data):
+			self._sources[row] = None # normative items show their UID in the heading
 			top_left = self.index(row, 0)
 			bot_right = self.index(row, len(self._headerData) - 1)
 			self.dataChanged.emit(top_left, bot_right, [Qt.DisplayRole, Qt.BackgroundRole, Qt.ForegroundRole])
@@ -566,20 +857,34 @@ class RequirementManager(QWidget):
 
 		self.view.horizontalHeader().setStretchLastSection(True)
 		self.view.setWordWrap(True)
-		self.view.resizeColumnsToContents()
-		
-		# Set wider default widths for level and header columns
-		try:
-			levelCol = self.model._headerData.index('level')
-			headerCol = self.model._headerData.index('header')
-			self.view.setColumnWidth(levelCol, 100)  # Fits ~9 characters for level numbers like "1.2.3"
-			self.view.setColumnWidth(headerCol, 170)  # Fits ~16 characters for header text
-		except ValueError:
-			# Columns might not exist, ignore
-			pass
+
+		# Column widths and hidden columns from the last session; measured from contents otherwise
+		if not self.restoreViewState():
+			self.view.resizeColumnsToContents()
+			
+			# Set wider default widths for level and header columns
+			try:
+				levelCol = self.model._headerData.index('level')
+				headerCol = self.model._headerData.index('header')
+				self.view.setColumnWidth(levelCol, 100)  # Fits ~9 characters for level numbers like "1.2.3"
+				self.view.setColumnWidth(headerCol, 170)  # Fits ~16 characters for header text
+			except ValueError:
+				# Columns might not exist, ignore
+				pass
 		
-		self.view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+		# Row heights are set from the render cache, see updateRowHeights(): no layout pass for known texts
+		self.view.verticalHeader().setSectionResizeMode(QHeaderView.Interactive)
 		self.view.verticalHeader().sectionDoubleClicked.connect(self.onRowHeaderDoubleClicked)
+		self._unmeasuredRows = set()
+		self._rowHeightsPending = True # until shown: the text column width is not known before
+		self._rowHeightsTimer = QTimer(self)
+		self._rowHeightsTimer.setSingleShot(True)
+		self._rowHeightsTimer.setInterval(30) # e.g. once at the end of a window resize
+		self._rowHeightsTimer.timeout.connect(self.updateRowHeights)
+		self.view.horizontalHeader().sectionResized.connect(self.onSectionResized)
+		self.view.verticalScrollBar().valueChanged.connect(self.measureVisibleRows)
+		self.model.reloaded.connect(self._rowHeightsTimer.start)
+		self.model.dataChanged.connect(self.onDataChanged)
 		self.view.setSelectionMode(QAbstractItemView.SingleSelection)
 		self.view.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
 		self.view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel) # only has effect on the scrollbar dragging
@@ -626,8 +931,100 @@ class RequirementManager(QWidget):
 		ly.addWidget(self.view)
 		self.setLayout(ly)
 
+	def _settingsGroup(self):
+		return 'documents/' + settingsKey(self.model._document.path)
+
+	def restoreViewState(self):
+		'''Restores the view state saved by saveViewState(). Returns False if there is none.'''
+		self._pendingScroll = None
+		settings = viewSettings()
+		settings.beginGroup(self._settingsGroup())
+		try:
+			columns = json.loads(settings.value('columns', 'null'))
+			if columns != self.model._headerData: # attributes changed since last time: widths are meaningless
+				return False
+			if not self.view.horizontalHeader().restoreState(settings.value('header', QByteArray())):
+				return False
+			self.delegate.indentTextByLevel = settings.value('indent', False, type=bool)
+			self._pendingScroll = settings.value('scroll', 0, type=int) # scroll range is known only when shown
+			return True
+		except (TypeError, ValueError):
+			return False
+		finally:
+			settings.endGroup()
+
+	def saveViewState(self):
+		'''Saves column widths, hidden columns, scroll position and indentation for this document.'''
+		settings = viewSettings()
+		settings.beginGroup(self._settingsGroup())
+		settings.setValue('columns', json.dumps(self.model._headerData))
+		settings.setValue('header', self.view.horizontalHeader().saveState())
+		settings.setValue('indent', self.delegate.indentTextByLevel)
+		settings.setValue('scroll', self.view.verticalScrollBar().value())
+		settings.endGroup()
+
+	def showEvent(self, event):
+		super(RequirementManager, self).showEvent(event)
+		if self._rowHeightsPending:
+			self._rowHeightsTimer.start()
+
+	def updateRowHeights(self):
+		'''
+		Sets the row heights from the sizes in the render cache, without rendering anything.
+		Rows never measured at this width get the default height until they are visible.
+		'''
+		if not self.isVisible():
+			self._rowHeightsPending = True
+			return
+		self._rowHeightsPending = False
+		header = self.view.verticalHeader()
+		width = self.view.columnWidth(len(self.model._headerData) - 1)
+		grid = 1 if self.view.showGrid() else 0 # as QTableView.sizeHintForRow()
+		self._unmeasuredRows = set()
+		for row in range(len(self.model._data)):
+			size = self.delegate.cachedSize(self.model, row, width)
+			if size is None:
+				self._unmeasuredRows.add(row)
+				header.resizeSection(row, header.defaultSectionSize())
+			else:
+				header.resizeSection(row, max(header.minimumSectionSize(), math.ceil(size[1]) + grid))
+		self.measureVisibleRows()
+
+		if self._pendingScroll is not None:
+			value = self._pendingScroll
+			self._pendingScroll = None
+			QTimer.singleShot(0, lambda: self.view.verticalScrollBar().setValue(value)) # scroll range is updated later
+
+	def measureVisibleRows(self):
+		'''Measures the visible rows whose size is not in the render cache.'''
+		viewport = self.view.viewport()
+		for attempt in range(10): # measured rows change which rows are visible
+			if not self._unmeasuredRows:
+				return
+			first = self.view.rowAt(0)
+			last = self.view.rowAt(viewport.height() - 1)
+			if first < 0:
+				return
+			if last < 0: # table shorter than the viewport
+				last = len(self.model._data) - 1
+			rows = [row for row in range(first, last + 1) if row in self._unmeasuredRows]
+			if not rows:
+				return
+			for row in rows:
+				self._unmeasuredRows.discard(row)
+				self.view.resizeRowToContents(row)
+
+	def onSectionResized(self, logicalIndex, oldSize, newSize):
+		if logicalIndex == len(self.model._headerData) - 1: # text column
+			self._rowHeightsTimer.start()
+
+	def onDataChanged(self, topLeft, bottomRight, roles=None):
+		for row in range(topLeft.row(), bottomRight.row() + 1):
+			self.view.resizeRowToContents(row)
+
 	def onIndentToggleChanged(self, state):
 		self.delegate.indentTextByLevel = bool(state)
+		self._rowHeightsTimer.start()
 		self.view.viewport().update()
 
 	def onAddClicked(self):
@@ -717,39 +1114,250 @@ class RequirementManager(QWidget):
 
 		menu.exec(self.view.mapToGlobal(pos))
 
+class RequirementStats(QObject):
+	'''
+	Requirement counters of a document, kept up to date from the model signals.
+
+	Each row contributes a set of facts (reviewed, normative, ..., custom attribute values):
+	an edit removes the old facts of the row and adds the new ones, without scanning the document.
+	Counters are also forwarded to the totals, if any (the whole tree statistics).
+	'''
+	changed = Signal()
+
+	def __init__(self, model=None, totals=None, parent=None):
+		super(RequirementStats, self).__init__(parent)
+		self.model = model
+		self.totals = totals
+		self.counts = Counter()
+		self.histograms = {} # custom attribute -> Counter of values
+		self._facts = [] # facts of each model row
+		if model is not None:
+			model.dataChanged.connect(self.onDataChanged)
+			model.reloaded.connect(self.rebuild)
+			self.rebuild()
+
+	def _rowFacts(self, row):
+		mdl = self.model
+		item = mdl._data[row][len(mdl._headerData)]
+		heading = item.get('level').heading
+		counts = ['items']
+		if item.get('reviewed'):
+			counts.append('reviewed')
+		if item.get('normative'):
+			counts.append('normative')
+		if item.get('derived'):
+			counts.append('derived')
+		if heading:
+			counts.append('heading')
+		if item.get('links'):
+			counts.append('linked')
+		# requirements that must link to a parent requirement
+		if mdl._document.parent and item.get('normative') and not item.get('derived') and not heading:
+			counts.append('needsLink')
+			if item.get('links'):
+				counts.append('needsLinkLinked')
+		values = tuple((attr, str(item.get(attr))) for attr in mdl._userHeaderData)
+		return tuple(counts), values
+
+	def _apply(self, facts, sign):
+		counts, values = facts
+		for name in counts:
+			self.counts[name] += sign
+		for attr, value in values:
+			histogram = self.histograms.setdefault(attr, Counter())
+			histogram[value] += sign
+			if not histogram[value]:
+				del histogram[value]
+		if self.totals is not None:
+			self.totals._apply(facts, sign)
+
+	@Slot()
+	def rebuild(self):
+		for facts in self._facts:
+			self._apply(facts, -1)
+		self._facts = [self._rowFacts(row) for row in range(len(self.model._data))]
+		for facts in self._facts:
+			self._apply(facts, +1)
+		self.notify()
+
+	def onDataChanged(self, topLeft, bottomRight, roles=None):
+		for row in range(topLeft.row(), bottomRight.row() + 1):
+			facts = self._rowFacts(row)
+			if facts != self._facts[row]:
+				self._apply(self._facts[row], -1)
+				self._apply(facts, +1)
+				self._facts[row] = facts
+		self.notify()
+
+	def notify(self):
+		self.changed.emit()
+		if self.totals is not None:
+			self.totals.notify()
+
+class StatisticsPanel(QWidget):
+	'''
+	Shows a RequirementStats.
+	Refreshed only while visible: counters are always up to date, formatting them is not free.
+	'''
+	MAX_VALUES = 20 # values shown for each custom attribute
+
+	def __init__(self, stats, parent=None):
+		super(StatisticsPanel, self).__init__(parent)
+		self.stats = stats
+		self.stats.changed.connect(self.onStatsChanged)
+		self.browser = QTextBrowser()
+		ly = QVBoxLayout()
+		ly.addWidget(self.browser)
+		self.setLayout(ly)
+		self._dirty = True
+
+	def onStatsChanged(self):
+		self._dirty = True
+		if self.isVisible():
+			self.refresh()
+
+	def showEvent(self, event):
+		super(StatisticsPanel, self).showEvent(event)
+		if self._dirty:
+			self.refresh()
+
+	def refresh(self):
+		self._dirty = False
+		counts = self.stats.counts
+		items = counts['items']
+
+		def row(name, n, total=items):
+			percent = ' (' + format(100.0 * n / total, '.1f') + '%)' if total else ''
+			return '<tr><td>' + name + '</td><td align="right">' + str(n) + '</td><td>' + percent + '</td></tr>'
+
+		html = '<h3>Requirements</h3><table cellpadding="3">'
+		html += row('Items', items, 0)
+		html += row('Reviewed', counts['reviewed'])
+		html += row('Unreviewed', items - counts['reviewed'])
+		html += row('Normative', counts['normative'])
+		html += row('Non-normative', items - counts['normative'])
+		html += row('Derived', counts['derived'])
+		html += row('Headings', counts['heading'])
+		html += row('With links', counts['linked'])
+		if counts['needsLink']:
+			html += row('Link coverage (normative, not derived)', counts['needsLinkLinked'], counts['needsLink'])
+		html += '</table>'
+
+		for attr in sorted(self.stats.histograms):
+			histogram = self.stats.histograms[attr]
+			if not histogram:
+				continue
+			html += '<h3>' + attr.replace('&', '&amp;').replace('<', '&lt;') + '</h3><table cellpadding="3">'
+			for value, n in histogram.most_common(self.MAX_VALUES):
+				html += row(value.replace('&', '&amp;').replace('<', '&lt;'), n)
+			if len(histogram) > self.MAX_VALUES:
+				html += '<tr><td colspan="3">... ' + str(len(histogram) - self.MAX_VALUES) + ' more values</td></tr>'
+			html += '</table>'
+		self.browser.setHtml(html)
+
 # Main application
 class MainWindow(QMainWindow):
+	'''
+	Main window: one tab for each document.
+	The window is created empty, with a loading message; call load() once it is visible.
+	'''
 	def __init__(self, parent=None):
 		super(MainWindow, self).__init__(parent)
 		self.setWindowTitle('Doorhole - doorstop requirements editor')
 		self.resize(1400, 900)  # Set default window size
+		self.managers = []
 
+		self.loadingLabel = QLabel('Loading requirements...')
+		self.loadingLabel.setAlignment(Qt.AlignCenter)
+		self.setCentralWidget(self.loadingLabel)
+
+	def setLoadingState(self, text):
+		self.loadingLabel.setText(text)
+		QApplication.processEvents() # the event loop is not running yet, paint now
+
+	def load(self):
 		global reqtree
-		reqtree = doorstop.build()
+		self.setLoadingState('Loading doorstop...')
+		loadDoorstop()
+		self.setLoadingState('Loading requirements...')
+		with profile.step('doorstop.build()'):
+			reqtree = doorstop.build()
 
+		self.setLoadingState('Loading documents...')
 		self.tabs = QTabWidget()
-		self.setCentralWidget(self.tabs)
+		self.treeStats = RequirementStats()
 
 		# One tab for each document
 		for document in reqtree:
-			# container widget
-			container = QTabWidget()
+			with profile.step('load document ' + document.prefix):
+				# container widget
+				container = QTabWidget()
+
+				# widgets
+				reqsW = QWidget()
+				reqsView = RequirementManager(document.prefix)
+				self.managers.append(reqsView)
 
-			# widgets
-			reqsW = QWidget()
-			reqsView = RequirementManager(document.prefix)
+				reqsLy = QVBoxLayout()
+				reqsLy.addWidget(reqsView)
+				reqsW.setLayout(reqsLy)
 
-			reqsLy = QVBoxLayout()
-			reqsLy.addWidget(reqsView)
-			reqsW.setLayout(reqsLy)
+				container.addTab(reqsW, 'Requirements')
+				container.addTab(StatisticsPanel(RequirementStats(reqsView.model, self.treeStats)), 'Statistics')
 
-			container.addTab(reqsW, 'Requirements')
+				title = document.parent + ' -> ' + document.prefix if document.parent else document.prefix
+				self.tabs.addTab(container, title)
+
+		self.tabs.addTab(StatisticsPanel(self.treeStats), 'Statistics')
+
+		# Back to the document of the last session
+		active = viewSettings().value(self._settingsGroup() + '/activeDocument')
+		for i, reqsView in enumerate(self.managers):
+			if str(reqsView._docId) == active:
+				self.tabs.setCurrentIndex(i)
+
+		self.setCentralWidget(self.tabs)
 
-			title = document.parent + ' -> ' + document.prefix if document.parent else document.prefix
-			self.tabs.addTab(container, title)
+	def _settingsGroup(self):
+		return 'trees/' + settingsKey(reqtree.root)
+
+	def closeEvent(self, event):
+		if self.managers and self.tabs.currentIndex() < len(self.managers): # not the tree statistics
+			settings = viewSettings()
+			settings.setValue(self._settingsGroup() + '/activeDocument', str(self.managers[self.tabs.currentIndex()]._docId))
+		for reqsView in self.managers:
+			reqsView.saveViewState()
+		if rendercache is not None:
+			rendercache.save()
+		super(MainWindow, self).closeEvent(event)
+
+def parseArgs(argv):
+	parser = argparse.ArgumentParser(description='A graphical requirements editor for doorstop.')
+	parser.add_argument('--startup-profile', action='store_true', help='report import and initialization timings')
+	parser.add_argument('--serve', action='store_true', help='do not open the editor, serve the requirements as a local HTTP/JSON API')
+	parser.add_argument('--host', default='127.0.0.1', help='--serve address (default: %(default)s)')
+	parser.add_argument('--port', type=int, default=8765, help='--serve port (default: %(default)s)')
+	parser.add_argument('--poll', type=float, default=2.0, help='--serve interval between requirement file checks, in seconds (default: %(default)s)')
+	args, qtArgs = parser.parse_known_args(argv[1:]) # unknown arguments are left to Qt...
+	if args.serve and qtArgs: # ...but there is no Qt application in server mode
+		parser.error('unrecognized arguments: ' + ' '.join(qtArgs))
+	return args, qtArgs
 
 if __name__ == "__main__":
-	app = QApplication(sys.argv)
+	args, qtArgs = parseArgs(sys.argv)
+	if args.serve:
+		# the server module is only loaded when needed; it must use this script's globals, not a second copy
+		sys.modules.setdefault('doorhole', sys.modules[__name__])
+		import doorhole_server
+		sys.exit(doorhole_server.serve(args))
+	app = QApplication(sys.argv[:1] + qtArgs)
 	win = MainWindow()
 	win.show()
+	with profile.step('first window'):
+		app.processEvents()
+	with profile.step('load'):
+		win.load()
+	if args.startup_profile:
+		# reported when the first screen of requirements has been painted
+		QTimer.singleShot(0, lambda: (profile.mark('first screen'), profile.report()))
 	sys.exit(app.exec())
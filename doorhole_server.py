@@ -0,0 +1,296 @@
+# Headless server of doorhole (doorhole.py --serve)
+#
+# Loaded only with --serve, so that the editor doesn't pay for the HTTP modules.
+
+import os
+import json
+import time
+import threading
+import itertools
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import doorhole
+
+def jsonValue(value):
+	'''Doorstop attribute value (Level, UID, Text, ...) as a JSON-friendly value.'''
+	if value is None or isinstance(value, (bool, int, float)):
+		return value
+	if isinstance(value, (list, tuple, set)):
+		return [jsonValue(v) for v in value]
+	if isinstance(value, dict):
+		return {str(k): jsonValue(v) for k, v in value.items()}
+	return str(value)
+
+def itemData(item, prefix):
+	data = {attr: jsonValue(item.get(attr)) for attr in item.data}
+	data['uid'] = str(item.uid)
+	data['document'] = prefix
+	data['path'] = item.path
+	return data
+
+def matchesFilter(value, wanted):
+	'''True if an attribute value matches any of the wanted values (query strings).'''
+	if isinstance(value, list): # e.g. links: any of them
+		return any(matchesFilter(v, wanted) for v in value)
+	if isinstance(value, bool):
+		return str(value).lower() in [w.lower() for w in wanted]
+	return ('' if value is None else str(value)) in wanted
+
+class TreeSnapshot():
+	'''
+	JSON-ready view of the requirements tree.
+	Never modified once published: the server swaps in a new snapshot when files change,
+	so request threads can read it without locking.
+	'''
+	def __init__(self, documents, order, items, sources):
+		self.documents = documents # document info, in tree order
+		self.order = order # document prefix -> item UIDs, in level order
+		self.items = items # item UID -> item data
+		self.sources = sources # item UID -> (markdown text, base directory), see requirementSource()
+
+class RequirementRequestHandler(BaseHTTPRequestHandler):
+	'''
+	Read-only JSON API:
+		- GET /documents
+		- GET /documents/<prefix>
+		- GET /documents/<prefix>/items?<attribute>=<value>&offset=0&limit=100
+		- GET /items?document=<prefix>&<attribute>=<value>&offset=0&limit=100
+		- GET /items/<uid>
+		- GET /items/<uid>/html
+
+	Item lists are paginated (see "next" in the response), or streamed as
+	newline-delimited JSON with format=ndjson.
+	'''
+	protocol_version = 'HTTP/1.1' # keep-alive and chunked streaming
+	PAGE_SIZE = 100
+	MAX_PAGE_SIZE = 1000
+
+	def log_message(self, format, *args):
+		doorhole.log.debug('[' + self.address_string() + '] ' + format % args)
+
+	def do_GET(self):
+		url = urllib.parse.urlsplit(self.path)
+		query = urllib.parse.parse_qs(url.query)
+		parts = [urllib.parse.unquote(p) for p in url.path.split('/') if p]
+		snapshot = self.server.snapshot # the same snapshot for the whole request
+		try:
+			if parts == ['documents']:
+				self.sendJson([dict(d, items=len(snapshot.order[d['prefix']])) for d in snapshot.documents])
+			elif len(parts) == 2 and parts[0] == 'documents':
+				documents = [d for d in snapshot.documents if d['prefix'] == parts[1]]
+				if not documents:
+					raise LookupError('Document not found: ' + parts[1])
+				self.sendJson(dict(documents[0], items=len(snapshot.order[parts[1]])))
+			elif len(parts) == 3 and parts[0] == 'documents' and parts[2] == 'items':
+				self.sendItems(snapshot, [parts[1]], query)
+			elif parts == ['items']:
+				prefixes = query.pop('document', [d['prefix'] for d in snapshot.documents])
+				self.sendItems(snapshot, prefixes, query)
+			elif len(parts) == 2 and parts[0] == 'items':
+				if parts[1] not in snapshot.items:
+					raise LookupError('Item not found: ' + parts[1])
+				self.sendJson(snapshot.items[parts[1]])
+			elif len(parts) == 3 and parts[0] == 'items' and parts[2] == 'html':
+				if parts[1] not in snapshot.sources:
+					raise LookupError('Item not found: ' + parts[1])
+				try: # from the snapshot: the doorstop item may be reloading in the watcher thread
+					html = doorhole.renderCache().render(*snapshot.sources[parts[1]])
+				except Exception as e:
+					self.sendError(500, 'Cannot render ' + parts[1] + ': ' + str(e))
+					return
+				self.sendBody(html.encode('utf-8'), 'text/html; charset=utf-8')
+			else:
+				raise LookupError('Not found: ' + url.path)
+		except LookupError as e:
+			self.sendError(404, str(e.args[0]))
+		except ValueError as e:
+			self.sendError(400, str(e))
+
+	def sendItems(self, snapshot, prefixes, query):
+		ndjson = query.pop('format', ['json'])[0] == 'ndjson'
+		offset = int(query.pop('offset', ['0'])[0])
+		limit = query.pop('limit', [None])[0]
+		limit = int(limit) if limit is not None else None
+		if offset < 0 or (limit is not None and limit < 1):
+			raise ValueError('offset must be >= 0 and limit >= 1')
+		for prefix in prefixes:
+			if prefix not in snapshot.order:
+				raise LookupError('Document not found: ' + prefix)
+
+		# every other parameter is an attribute filter
+		selected = (snapshot.items[uid] for prefix in prefixes for uid in snapshot.order[prefix])
+		selected = (data for data in selected if all(matchesFilter(data.get(attr), wanted) for attr, wanted in query.items()))
+
+		if ndjson: # streamed: everything by default, no total
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/x-ndjson')
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+			for data in itertools.islice(selected, offset, offset + limit if limit is not None else None):
+				self.writeChunk((json.dumps(data) + '\n').encode('utf-8'))
+			self.writeChunk(b'')
+			return
+
+		limit = min(limit or self.PAGE_SIZE, self.MAX_PAGE_SIZE)
+		selected = list(selected)
+		nextOffset = offset + limit if offset + limit < len(selected) else None
+		self.sendJson({
+			'total': len(selected),
+			'offset': offset,
+			'limit': limit,
+			'next': nextOffset,
+			'items': selected[offset:offset + limit],
+		})
+
+	def writeChunk(self, data):
+		self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+
+	def sendJson(self, data, code=200):
+		self.sendBody(json.dumps(data).encode('utf-8'), 'application/json', code)
+
+	def sendError(self, code, message):
+		self.sendJson({'error': message}, code)
+
+	def sendBody(self, body, contentType, code=200):
+		self.send_response(code)
+		self.send_header('Content-Type', contentType)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+class RequirementServer(ThreadingHTTPServer):
+	'''
+	Loads the requirements tree once and serves it over HTTP (see RequirementRequestHandler).
+
+	The tree is kept fresh by polling the requirement files: edited items are reloaded
+	one by one, the whole tree is rebuilt only when items are added or removed (a changed
+	directory is not enough: atomic saves and git checkouts change it too).
+	'''
+	daemon_threads = True
+
+	def __init__(self, address, interval=2.0):
+		super(RequirementServer, self).__init__(address, RequirementRequestHandler)
+		self.root = os.getcwd() # where the tree is searched from, whatever happens later
+		doorhole.renderCache() # created before the request threads share it
+		self.interval = interval
+		self.build()
+
+	def _mtime(self, path):
+		try:
+			return os.stat(path).st_mtime_ns
+		except OSError:
+			return None
+
+	def _listing(self, path):
+		'''Item files and subdirectories (possible child documents) of a directory.'''
+		try:
+			return frozenset(e.name for e in os.scandir(path)
+				if not e.name.startswith('.') and (e.name.endswith('.yml') or e.is_dir()))
+		except OSError:
+			return None
+
+	def build(self):
+		doorhole.loadDoorstop()
+		with doorhole.profile.step('doorstop.build()'):
+			doorhole.reqtree = doorhole.doorstop.build(cwd=self.root)
+
+		itemsByUid = {} # item UID -> (doorstop item, document prefix)
+		files = {} # item file -> (mtime, UID)
+		dirs = {} # directory -> (mtime, listing): listing changes mean added/removed items
+		configs = {} # document configuration file -> mtime
+		documents, order, items, sources = [], {}, {}, {}
+		for document in doorhole.reqtree:
+			prefix = str(document.prefix)
+			dirs[document.path] = (self._mtime(document.path), self._listing(document.path))
+			config = os.path.join(document.path, '.doorstop.yml')
+			configs[config] = self._mtime(config)
+			order[prefix] = []
+			for item in doorhole.iter_items(document):
+				uid = str(item.uid)
+				itemsByUid[uid] = (item, prefix)
+				files[item.path] = (self._mtime(item.path), uid)
+				itemDir = os.path.dirname(item.path)
+				if itemDir not in dirs:
+					dirs[itemDir] = (self._mtime(itemDir), self._listing(itemDir))
+				items[uid] = itemData(item, prefix)
+				sources[uid] = doorhole.requirementSource(item)
+				order[prefix].append(uid)
+			documents.append({
+				'prefix': prefix,
+				'parent': str(document.parent) if document.parent else None,
+				'path': document.path,
+			})
+
+		self._items, self._files, self._dirs, self._configs = itemsByUid, files, dirs, configs
+		self.snapshot = TreeSnapshot(documents, order, items, sources)
+		doorhole.log.info('Serving ' + str(len(items)) + ' requirements from ' + str(len(documents)) + ' documents')
+
+	def refresh(self):
+		'''Reloads the items changed on disk. Rebuilds the whole tree if items were added or removed.'''
+		if any(self._mtime(path) != mtime for path, mtime in self._configs.items()):
+			doorhole.log.info('Document configuration changed, reloading the tree')
+			self.build()
+			return
+		for path, (mtime, listing) in list(self._dirs.items()):
+			now = self._mtime(path)
+			if now == mtime:
+				continue
+			if self._listing(path) != listing:
+				doorhole.log.info('Requirements added or removed, reloading the tree')
+				self.build()
+				return
+			self._dirs[path] = (now, listing) # e.g. a file saved atomically: reloaded below
+
+		changed = []
+		for path, (mtime, uid) in self._files.items():
+			now = self._mtime(path)
+			if now != mtime:
+				changed.append((path, now, uid))
+		if not changed:
+			return
+
+		snapshot = self.snapshot
+		order, items, sources = dict(snapshot.order), dict(snapshot.items), dict(snapshot.sources)
+		prefixes = set()
+		reloaded = []
+		for path, mtime, uid in changed:
+			item, prefix = self._items[uid]
+			try:
+				item.load(reload=True)
+				items[uid] = itemData(item, prefix)
+				sources[uid] = doorhole.requirementSource(item)
+			except Exception as e: # e.g. a file saved halfway: its mtime is not recorded, tried again at the next check
+				doorhole.log.error('Cannot reload requirement [' + uid + ']: ' + str(e))
+				continue
+			reloaded.append((path, mtime, uid))
+			prefixes.add(prefix)
+			doorhole.log.debug('Reloaded requirement [' + uid + ']')
+		for prefix in prefixes: # levels may have changed
+			order[prefix] = [str(item.uid) for item in doorhole.iter_items(doorhole.reqtree.find_document(prefix))]
+		self.snapshot = TreeSnapshot(snapshot.documents, order, items, sources)
+
+		# only now the reloaded files are up to date
+		for path, mtime, uid in reloaded:
+			self._files[path] = (mtime, uid)
+
+	def watch(self):
+		while True:
+			time.sleep(self.interval)
+			try:
+				self.refresh()
+			except Exception as e: # e.g. a file saved halfway: keep serving the last good snapshot
+				doorhole.log.error('Cannot reload requirements: ' + str(e))
+
+def serve(args):
+	server = RequirementServer((args.host, args.port), args.poll)
+	threading.Thread(target=server.watch, daemon=True).start()
+	doorhole.log.info('Listening on http://' + args.host + ':' + str(args.port))
+	if args.startup_profile:
+		doorhole.profile.report()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
+	doorhole.renderCache().save() # drops the HTML not used for a long time